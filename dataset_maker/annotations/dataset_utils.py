@@ -1,7 +1,18 @@
 import tensorflow as tf
 import numpy as np
 import contextlib2
-from typing import List
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Callable, Iterable, Iterator, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
 
 
 def int64_feature(value):
@@ -24,6 +35,69 @@ def float_list_feature(value):
     return tf.train.Feature(float_list=tf.train.FloatList(value=value))
 
 
+def load_json(path: str) -> Any:
+    """
+    Loads a json file, using orjson when it is installed.
+    :param path: The path of the json file.
+    :return: The loaded json data.
+    """
+    if orjson is not None:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def dump_json(data: Any, path: str) -> None:
+    """
+    Dumps data to a json file, using orjson when it is installed.
+    :param data: The data being dumped.
+    :param path: The path of the json file.
+    """
+    if orjson is not None:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS))
+    else:
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+
+def map_concurrently(func: Callable[..., Tuple], iterable: Iterable, num_outputs: int) -> Tuple[List, ...]:
+    """
+    Maps a function over an iterable in a thread pool, overlapping the file reads of each call.
+    :param func: The function applied to each item, returning a tuple of length :param num_outputs.
+    :param iterable: The items being mapped.
+    :param num_outputs: The number of values returned by :param func.
+    :return: A tuple of :param num_outputs lists, each list containing one value per item in the original order.
+    """
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = list(executor.map(func, iterable))
+    if not results:
+        return tuple([] for _ in range(num_outputs))
+    return tuple(list(values) for values in zip(*results))
+
+
+def stream_concurrently(func: Callable, iterable: Iterable, max_pending: Optional[int] = None) -> Iterator:
+    """
+    Lazily maps a function over an iterable in a thread pool, yielding the results in the original order. At most
+    :param max_pending items are being worked on or waiting to be consumed, bounding the memory used.
+    :param func: The function applied to each item.
+    :param iterable: The items being mapped.
+    :param max_pending: The maximum number of items in flight, by default twice the number of workers.
+    :return: An iterator of the results of :param func.
+    """
+    if max_pending is None:
+        max_pending = 2 * MAX_WORKERS
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
 def open_sharded_tfrecords(exit_stack: contextlib2.ExitStack, base_path: str, num_shards: int) \
         -> List[contextlib2.ExitStack]:
     """
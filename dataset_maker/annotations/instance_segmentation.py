@@ -1,12 +1,14 @@
 from dataset_maker.annotations.download_upload import LoaderDownloader
 from dataset_maker.patterns import SingletonStrategies, strategy_method
 from abc import ABCMeta, abstractmethod
-from typing import Tuple, List
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Tuple, List, Dict
 import numpy as np
 from dataset_maker import utils
 import json
 import os
-import io
+import cv2
 import tensorflow as tf
 from dataset_maker.annotations import dataset_utils, vgg_utils
 import contextlib2
@@ -28,6 +30,20 @@ class InstanceSegmentationAnnotationFormats(SingletonStrategies):
 FORMATS = InstanceSegmentationAnnotationFormats()
 
 
+def encode_mask(poly: Tuple[List[int], List[int]], width: int, height: int) -> bytes:
+    """
+    Rasterises a polygon into a mask and encodes it as a 1-bit png.
+    :param poly: The x and y points of the polygon.
+    :param width: The width of the image the polygon is in.
+    :param height: The height of the image the polygon is in.
+    :return: The png encoded mask.
+    """
+    mask = utils.polygon_to_mask(*poly, width, height)
+    # Low compression trades a slightly larger mask for a much faster encode.
+    _, png = cv2.imencode(".png", mask, [cv2.IMWRITE_PNG_COMPRESSION, 1, cv2.IMWRITE_PNG_BILEVEL, 1])
+    return png.tobytes()
+
+
 class InstanceSegmentationAnnotation(LoaderDownloader, metaclass=ABCMeta):
     """
     Abstract base class for InstanceSegmentationAnnotation as a Loader.
@@ -54,59 +70,64 @@ class InstanceSegmentationAnnotation(LoaderDownloader, metaclass=ABCMeta):
 
         with contextlib2.ExitStack() as close_stack:
             output_tfrecords = dataset_utils.open_sharded_tfrecords(close_stack, output_dir, num_shards)
-
-            for idx, (filename, image, bbox_per, poly_per, cls_per) in \
-                    enumerate(zip(filenames, images, bboxes, polygons, classes)):
-                # TODO maybe look into different way or find the common standard
-                with tf.io.gfile.GFile(f"{image_dir}/{filename}", "rb") as fid:
-                    encoded_image = fid.read()
-
-                width, height = image.size
-
-                xmins = []
-                xmaxs = []
-                ymins = []
-                ymaxs = []
-                encode_masks = []
-                classes_text = []
-                mapped_classes = []
-
-                for (y0, x0, y1, x1), poly, cls in zip(bbox_per, poly_per, cls_per):
-                    ymins.append(float(y0 / height))
-                    xmins.append(float(x0 / width))
-                    ymaxs.append(float(y1 / height))
-                    xmaxs.append(float(x1 / width))
-
-                    mask = utils.polygon_to_mask(*poly, width, height)
-                    mask_image = Image.fromarray(mask)
-                    output = io.BytesIO()
-                    mask_image.save(output, format='PNG')
-                    encode_masks.append(output.getvalue())
-
-                    classes_text.append(cls.encode("utf8"))
-                    mapped_classes.append(class_map[cls])
-
-                image_format = filename.split(".")[-1].encode("utf8")
-                encode_filename = filename.encode("utf8")
-
-                tf_example = tf.train.Example(features=tf.train.Features(feature={
-                    "image/height": dataset_utils.int64_feature(height),
-                    "image/width": dataset_utils.int64_feature(width),
-                    "image/filename": dataset_utils.bytes_feature(encode_filename),
-                    "image/source_id": dataset_utils.bytes_feature(encode_filename),
-                    "image/encoded": dataset_utils.bytes_feature(encoded_image),
-                    "image/format": dataset_utils.bytes_feature(image_format),
-                    "image/object/bbox/xmin": dataset_utils.float_list_feature(xmins),
-                    "image/object/bbox/xmax": dataset_utils.float_list_feature(xmaxs),
-                    "image/object/bbox/ymin": dataset_utils.float_list_feature(ymins),
-                    "image/object/bbox/ymax": dataset_utils.float_list_feature(ymaxs),
-                    "image/object/class/text": dataset_utils.bytes_list_feature(classes_text),
-                    "image/object/class/label": dataset_utils.int64_list_feature(mapped_classes),
-                    "image/object/mask": dataset_utils.bytes_list_feature(encode_masks)
-                }))
-
+            executor = close_stack.enter_context(ThreadPoolExecutor(max_workers=dataset_utils.MAX_WORKERS))
+
+            # Examples are read and serialised in worker threads while this thread writes them out.
+            serialize_example = partial(InstanceSegmentationAnnotation._serialize_example, image_dir, class_map,
+                                        executor)
+            examples = dataset_utils.stream_concurrently(serialize_example,
+                                                         zip(filenames, images, bboxes, polygons, classes))
+            for idx, example in enumerate(examples):
                 shard_idx = idx % num_shards
-                output_tfrecords[shard_idx].write(tf_example.SerializeToString())
+                output_tfrecords[shard_idx].write(example)
+
+    @staticmethod
+    def _serialize_example(image_dir: str, class_map: Dict[str, int], executor: ThreadPoolExecutor,
+                           item: Tuple) -> bytes:
+        """
+        Creates a serialised tf.train.Example for a single image.
+        :param image_dir: The image directory.
+        :param class_map: A map of classes to there encoded values.
+        :param executor: The executor used to encode the masks of the image.
+        :param item: The filename, image, bounding boxes, polygons and classes of the image.
+        :return: The serialised example.
+        """
+        filename, image, bbox_per, poly_per, cls_per = item
+        # TODO maybe look into different way or find the common standard
+        with tf.io.gfile.GFile(f"{image_dir}/{filename}", "rb") as fid:
+            encoded_image = fid.read()
+
+        width, height = image.size
+
+        y0, x0, y1, x1 = np.asarray(bbox_per, dtype=np.float64).reshape(-1, 4).T
+        ymins = (y0 / height).tolist()
+        xmins = (x0 / width).tolist()
+        ymaxs = (y1 / height).tolist()
+        xmaxs = (x1 / width).tolist()
+        classes_text = [cls.encode("utf8") for cls in cls_per]
+        mapped_classes = [class_map[cls] for cls in cls_per]
+
+        encode_masks = list(executor.map(partial(encode_mask, width=width, height=height), poly_per))
+
+        image_format = filename.split(".")[-1].encode("utf8")
+        encode_filename = filename.encode("utf8")
+
+        tf_example = tf.train.Example(features=tf.train.Features(feature={
+            "image/height": dataset_utils.int64_feature(height),
+            "image/width": dataset_utils.int64_feature(width),
+            "image/filename": dataset_utils.bytes_feature(encode_filename),
+            "image/source_id": dataset_utils.bytes_feature(encode_filename),
+            "image/encoded": dataset_utils.bytes_feature(encoded_image),
+            "image/format": dataset_utils.bytes_feature(image_format),
+            "image/object/bbox/xmin": dataset_utils.float_list_feature(xmins),
+            "image/object/bbox/xmax": dataset_utils.float_list_feature(xmaxs),
+            "image/object/bbox/ymin": dataset_utils.float_list_feature(ymins),
+            "image/object/bbox/ymax": dataset_utils.float_list_feature(ymaxs),
+            "image/object/class/text": dataset_utils.bytes_list_feature(classes_text),
+            "image/object/class/label": dataset_utils.int64_list_feature(mapped_classes),
+            "image/object/mask": dataset_utils.bytes_list_feature(encode_masks)
+        }))
+        return tf_example.SerializeToString()
 
 
 @strategy_method(InstanceSegmentationAnnotationFormats)
@@ -172,9 +193,8 @@ class VGG(InstanceSegmentationAnnotation):
             annotations_file = potential_annotations[0]
             annotations_file = f"{annotations_dir}/{annotations_file}"
 
-        with open(annotations_file, "r") as f:
-            annotations = json.load(f)
-            annotations = vgg_utils.convert_annotations_to_polygon(annotations)
+        annotations = dataset_utils.load_json(annotations_file)
+        annotations = vgg_utils.convert_annotations_to_polygon(annotations)
 
         names = []
         images = []
@@ -188,23 +208,15 @@ class VGG(InstanceSegmentationAnnotation):
             with Image.open(f"{image_dir}/{filename}") as image:
                 images.append(image)
 
-            bboxes_per = []
-            poly_per = []
-            classes_per = []
-
             regions = annotation["regions"]
             if isinstance(regions, dict):
                 regions = regions.values()
+            regions = list(regions)
 
-            for r in regions:
-                xs, ys = r["shape_attributes"]["all_points_x"], r["shape_attributes"]["all_points_y"]
-                bbox = utils.bbox(xs, ys)
-                bboxes_per.append(np.asarray(bbox))
-                poly_per.append((xs, ys))
-                classes_per.append(r["region_attributes"][region_label])
-            bboxes.append(np.asarray(bboxes_per))
+            poly_per = [(r["shape_attributes"]["all_points_x"], r["shape_attributes"]["all_points_y"]) for r in regions]
+            bboxes.append(utils.bboxes([xs for xs, _ in poly_per], [ys for _, ys in poly_per]))
             polygons.append(np.asarray(poly_per))
-            classes.append(np.asarray(classes_per))
+            classes.append(np.asarray([r["region_attributes"][region_label] for r in regions]))
         return names, images, bboxes, polygons, classes
 
     @staticmethod
@@ -231,8 +243,7 @@ class VGG(InstanceSegmentationAnnotation):
             }
             for name, poly_per, classes_per in zip(image_names, polygon, classes)
         }
-        with open(f"{download_dir}/vgg_annotations.json", "w") as f:
-            json.dump(annotations, f)
+        dataset_utils.dump_json(annotations, f"{download_dir}/vgg_annotations.json")
 
 
 @strategy_method(InstanceSegmentationAnnotationFormats)
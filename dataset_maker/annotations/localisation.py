@@ -5,11 +5,11 @@ from dataset_maker.annotations.download_upload import LoaderDownloader
 from abc import ABCMeta, abstractmethod
 from typing import Tuple, List, Union, Dict, Optional
 import numpy as np
-from xml.etree import ElementTree
-from functools import reduce
+from lxml import etree as ElementTree
+from xml.sax.saxutils import escape
+from functools import partial
 from dataset_maker import utils
 import json
-import re
 import os
 from collections import defaultdict
 import tensorflow as tf
@@ -18,6 +18,7 @@ import contextlib2
 from PIL import Image
 
 IMAGE_FORMATS = (".png", ".PNG", ".jpg", ".JPG", ".jpeg", ".JPEG")
+PASCAL_VOC_BBOX_TAGS = ("ymin", "xmin", "ymax", "xmax")
 
 
 class LocalisationAnnotationFormats(SingletonStrategies):
@@ -90,48 +91,55 @@ class LocalisationAnnotation(LoaderDownloader, metaclass=ABCMeta):
             else:
                 output_tfrecords = dataset_utils.open_sharded_tfrecords(close_stack, output_dir, num_shards)
 
-            for idx, (filename, image, bbox_per, cls_per) in enumerate(zip(filenames, images, bboxes, classes)):
-                # TODO maybe look into different way or find the common standard
-
-                with tf.io.gfile.GFile(f"{image_dir}/{filename}", "rb") as fid:
-                    encoded_image = fid.read()
-                width, height = image.size
-
-                xmins = []
-                xmaxs = []
-                ymins = []
-                ymaxs = []
-                classes_text = []
-                mapped_classes = []
-
-                for (y0, x0, y1, x1), cls in zip(bbox_per, cls_per):
-                    ymins.append(float(y0 / height))
-                    xmins.append(float(x0 / width))
-                    ymaxs.append(float(y1 / height))
-                    xmaxs.append(float(x1 / width))
-                    classes_text.append(cls.encode("utf8"))
-                    mapped_classes.append(class_map[cls])
-
-                image_format = filename.split(".")[-1].encode("utf8")
-                encode_filename = filename.encode("utf8")
-
-                tf_example = tf.train.Example(features=tf.train.Features(feature={
-                    "image/height": dataset_utils.int64_feature(height),
-                    "image/width": dataset_utils.int64_feature(width),
-                    "image/filename": dataset_utils.bytes_feature(encode_filename),
-                    "image/source_id": dataset_utils.bytes_feature(encode_filename),
-                    "image/encoded": dataset_utils.bytes_feature(encoded_image),
-                    "image/format": dataset_utils.bytes_feature(image_format),
-                    "image/object/bbox/xmin": dataset_utils.float_list_feature(xmins),
-                    "image/object/bbox/xmax": dataset_utils.float_list_feature(xmaxs),
-                    "image/object/bbox/ymin": dataset_utils.float_list_feature(ymins),
-                    "image/object/bbox/ymax": dataset_utils.float_list_feature(ymaxs),
-                    "image/object/class/text": dataset_utils.bytes_list_feature(classes_text),
-                    "image/object/class/label": dataset_utils.int64_list_feature(mapped_classes)
-                }))
-
+            # Examples are read and serialised in worker threads while this thread writes them out.
+            serialize_example = partial(LocalisationAnnotation._serialize_example, image_dir, class_map)
+            examples = dataset_utils.stream_concurrently(serialize_example, zip(filenames, images, bboxes, classes))
+            for idx, example in enumerate(examples):
                 shard_idx = idx % num_shards
-                output_tfrecords[shard_idx].write(tf_example.SerializeToString())
+                output_tfrecords[shard_idx].write(example)
+
+    @staticmethod
+    def _serialize_example(image_dir: str, class_map: Dict[str, int], item: Tuple) -> bytes:
+        """
+        Creates a serialised tf.train.Example for a single image.
+        :param image_dir: The image directory.
+        :param class_map: A map of classes to there encoded values.
+        :param item: The filename, image, bounding boxes and classes of the image.
+        :return: The serialised example.
+        """
+        filename, image, bbox_per, cls_per = item
+        # TODO maybe look into different way or find the common standard
+
+        with tf.io.gfile.GFile(f"{image_dir}/{filename}", "rb") as fid:
+            encoded_image = fid.read()
+        width, height = image.size
+
+        y0, x0, y1, x1 = np.asarray(bbox_per, dtype=np.float64).reshape(-1, 4).T
+        ymins = (y0 / height).tolist()
+        xmins = (x0 / width).tolist()
+        ymaxs = (y1 / height).tolist()
+        xmaxs = (x1 / width).tolist()
+        classes_text = [cls.encode("utf8") for cls in cls_per]
+        mapped_classes = [class_map[cls] for cls in cls_per]
+
+        image_format = filename.split(".")[-1].encode("utf8")
+        encode_filename = filename.encode("utf8")
+
+        tf_example = tf.train.Example(features=tf.train.Features(feature={
+            "image/height": dataset_utils.int64_feature(height),
+            "image/width": dataset_utils.int64_feature(width),
+            "image/filename": dataset_utils.bytes_feature(encode_filename),
+            "image/source_id": dataset_utils.bytes_feature(encode_filename),
+            "image/encoded": dataset_utils.bytes_feature(encoded_image),
+            "image/format": dataset_utils.bytes_feature(image_format),
+            "image/object/bbox/xmin": dataset_utils.float_list_feature(xmins),
+            "image/object/bbox/xmax": dataset_utils.float_list_feature(xmaxs),
+            "image/object/bbox/ymin": dataset_utils.float_list_feature(ymins),
+            "image/object/bbox/ymax": dataset_utils.float_list_feature(ymaxs),
+            "image/object/class/text": dataset_utils.bytes_list_feature(classes_text),
+            "image/object/class/label": dataset_utils.int64_list_feature(mapped_classes)
+        }))
+        return tf_example.SerializeToString()
 
 
 @strategy_method(LocalisationAnnotationFormats)
@@ -197,33 +205,35 @@ class VGG(LocalisationAnnotation):
             annotations_file = potential_annotations[0]
             annotations_file = f"{annotations_dir}/{annotations_file}"
 
-        with open(annotations_file, "r") as f:
-            annotations = json.load(f)
-            annotations = vgg_utils.convert_annotations_to_polygon(annotations)
+        annotations = dataset_utils.load_json(annotations_file)
+        annotations = vgg_utils.convert_annotations_to_polygon(annotations)
 
-        names = []
-        images = []
-        bboxes = []
-        classes = []
-        for filename, annotation in annotations.items():
-            names.append(filename)
-            with Image.open(f"{image_dir}/{filename}") as image:
-                images.append(image)
+        load_annotation = partial(VGG._load_annotation, image_dir, region_label)
+        return dataset_utils.map_concurrently(load_annotation, annotations.items(), 4)
 
-            bboxes_per = []
-            classes_per = []
+    @staticmethod
+    def _load_annotation(image_dir: str, region_label: str, item: Tuple[str, Dict]) -> \
+            Tuple[str, Image.Image, np.ndarray, np.ndarray]:
+        """
+        Loads the image and the bounding boxes and classes of a single VGG annotation.
+        :param image_dir: THe directory of where the images are stored.
+        :param region_label: The key that identifies the label being loaded.
+        :param item: The filename and the annotation for that file.
+        :return: Returns the name, image, bounding boxes and classes for the image.
+        """
+        filename, annotation = item
 
-            regions = annotation["regions"]
-            if isinstance(regions, dict):
-                regions = regions.values()
+        regions = annotation["regions"]
+        if isinstance(regions, dict):
+            regions = regions.values()
+        regions = list(regions)
 
-            for r in regions:
-                bbox = utils.bbox(r["shape_attributes"]["all_points_x"], r["shape_attributes"]["all_points_y"])
-                bboxes_per.append(np.asarray(bbox))
-                classes_per.append(r["region_attributes"][region_label])
-            bboxes.append(np.asarray(bboxes_per))
-            classes.append(np.asarray(classes_per))
-        return names, images, bboxes, classes
+        bboxes_per = utils.bboxes([r["shape_attributes"]["all_points_x"] for r in regions],
+                                  [r["shape_attributes"]["all_points_y"] for r in regions])
+        classes_per = np.asarray([r["region_attributes"][region_label] for r in regions])
+
+        with Image.open(f"{image_dir}/{filename}") as image:
+            return filename, image, bboxes_per, classes_per
 
     @staticmethod
     def download(download_dir: str, image_names: List[str], images: List, bboxes: List[np.ndarray],
@@ -264,8 +274,7 @@ class VGG(LocalisationAnnotation):
             }
             for name, bboxes_per, classes_per in zip(image_names, bboxes, classes)
         }
-        with open(f"{download_dir}/vgg_annotations.json", "w") as f:
-            json.dump(annotations, f)
+        dataset_utils.dump_json(annotations, f"{download_dir}/vgg_annotations.json")
 
 
 @strategy_method(LocalisationAnnotationFormats)
@@ -308,30 +317,34 @@ class PascalVOC(LocalisationAnnotation):
             format [y0, x0, y1, x1].
             The classes will be a list of of np.ndarray with the shape (n,) and containing string information.
         """
-        annotation_files = [f for f in os.listdir(annotations_dir) if f.endswith(".xml")]
-        names = []
-        images = []
-        bboxes = []
-        classes = []
-        for f in annotation_files:
-            root = ElementTree.parse(f"{annotations_dir}/{f}")
-            name = root.find("filename").text
-            names.append(name)
-            with Image.open(f"{image_dir}/{name}") as image:
-                images.append(image)
-            bboxes_per = []
-            classes_per = []
-            for obj in root.findall("object"):
-                bbox = obj.find("bndbox")
-                y0 = int(bbox.find("ymin").text)
-                x0 = int(bbox.find("xmin").text)
-                y1 = int(bbox.find("ymax").text)
-                x1 = int(bbox.find("xmax").text)
-                bboxes_per.append(np.asarray([y0, x0, y1, x1]))
-                classes_per.append(obj.find("name").text)
-            bboxes.append(np.asarray(bboxes_per))
-            classes.append(np.asarray(classes_per))
-        return names, images, bboxes, classes
+        annotation_files = [f"{annotations_dir}/{f}" for f in os.listdir(annotations_dir) if f.endswith(".xml")]
+        return dataset_utils.map_concurrently(partial(PascalVOC._load_annotation, image_dir), annotation_files, 4)
+
+    @staticmethod
+    def _load_annotation(image_dir: str, annotation_file: str) -> Tuple[str, Image.Image, np.ndarray, np.ndarray]:
+        """
+        Loads the image and the bounding boxes and classes of a single Pascal VOC xml file.
+        :param image_dir: THe directory of where the images are stored.
+        :param annotation_file: The path of the xml file.
+        :return: Returns the name, image, bounding boxes and classes for the image.
+        """
+        name = None
+        bboxes_per = []
+        classes_per = []
+        # Stream the filename and objects, freeing each subtree once it has been read.
+        for _, elem in ElementTree.iterparse(annotation_file, events=("end",), tag=("filename", "object")):
+            if elem.tag == "filename":
+                name = elem.text
+            else:
+                bbox = elem.find("bndbox")
+                bboxes_per.append([int(bbox.findtext(tag)) for tag in PASCAL_VOC_BBOX_TAGS])
+                classes_per.append(elem.find("name").text)
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+        with Image.open(f"{image_dir}/{name}") as image:
+            return name, image, np.asarray(bboxes_per, dtype=np.int64).reshape(-1, 4), np.asarray(classes_per)
 
     @staticmethod
     def download(download_dir: str, image_names: List[str], images: List, bboxes: List[np.ndarray],
@@ -355,37 +368,25 @@ class PascalVOC(LocalisationAnnotation):
             f"len(bboxes): {len(bboxes)}\n" \
             f"len(classes): {len(classes)}"
 
-        folder = re.split("/|\\\\", download_dir)[-1]
+        # The layout is fixed, so the xml is written from string templates rather than built as an element tree.
+        folder = escape(os.path.basename(download_dir.rstrip("/\\")))
         for name, image, bboxes_per, classes_per in zip(image_names, images, bboxes, classes):
             w, h = image.size
             d = len(image.getbands())
 
-            root = ElementTree.Element("annotation")
-            ElementTree.SubElement(root, "folder").text = folder
-            ElementTree.SubElement(root, "filename").text = name
-
-            size = ElementTree.SubElement(root, "size")
-            ElementTree.SubElement(size, "width").text = str(w)
-            ElementTree.SubElement(size, "height").text = str(h)
-            ElementTree.SubElement(size, "depth").text = str(d)
-
-            for (y0, x0, y1, x1), cls in zip(bboxes_per, classes_per):
-                obj = ElementTree.SubElement(root, "object")
-                ElementTree.SubElement(obj, "name").text = str(cls)
-
-                ElementTree.SubElement(obj, "pose").text = "Unspecified"
-                ElementTree.SubElement(obj, "truncated").text = "Unspecified"
-                ElementTree.SubElement(obj, "difficult").text = "Unspecified"
-
-                bb_elm = ElementTree.SubElement(obj, "bndbox")
-                ElementTree.SubElement(bb_elm, "xmin").text = str(x0)
-                ElementTree.SubElement(bb_elm, "ymin").text = str(y0)
-                ElementTree.SubElement(bb_elm, "xmax").text = str(x1)
-                ElementTree.SubElement(bb_elm, "ymax").text = str(y1)
-
-            save_name = reduce(lambda n, fmt: n.strip(fmt), IMAGE_FORMATS, name)
+            objects = "".join(
+                f"<object><name>{escape(str(cls))}</name>"
+                "<pose>Unspecified</pose><truncated>Unspecified</truncated><difficult>Unspecified</difficult>"
+                f"<bndbox><xmin>{x0}</xmin><ymin>{y0}</ymin><xmax>{x1}</xmax><ymax>{y1}</ymax></bndbox></object>"
+                for (y0, x0, y1, x1), cls in zip(bboxes_per, classes_per)
+            )
+            annotation = f"<annotation><folder>{folder}</folder><filename>{escape(name)}</filename>" \
+                         f"<size><width>{w}</width><height>{h}</height><depth>{d}</depth></size>" \
+                         f"{objects}</annotation>"
+
+            save_name, _ = os.path.splitext(name)
             with open(f"{download_dir}/{save_name}.xml", "wb") as f:
-                f.write(ElementTree.tostring(root))
+                f.write(annotation.encode("ascii", "xmlcharrefreplace"))
 
 
 @strategy_method(LocalisationAnnotationFormats)
@@ -547,7 +548,7 @@ class YOLO(LocalisationAnnotation):
         Loads a YOLO txt files and gets the names, images bounding boxes and classes for thr image.
         :param image_dir: THe directory of where the images are stored.
         :param annotations_dir: The directory of the annotations file.
-        :param image_format: The format of the images being used.
+        :param image_format: The format of the images being used, used to choose between images sharing a name.
         :return: Returns names, images bounding boxes and classes
             The names will be a list of strings.
             The images will be a list of PIL images.
@@ -557,37 +558,60 @@ class YOLO(LocalisationAnnotation):
         :raise OSError: If there are no image files corresponding to an annotations txt filename.
         :raise OSError: If there more than one image file corresponding to an annotations txt filename.
         """
-        annotation_files = [f for f in os.listdir(annotations_dir) if f.endswith(".txt")]
-        names = []
-        images = []
-        bboxes = []
-        classes = []
-        for file in annotation_files:
-            file_path = f"{annotations_dir}/{file}"
-            image_path = f"{image_dir}/{file.strip('.txt')}.{image_format}"
-            name = re.split("/|\\\\", image_path)[-1]
-            names.append(name)
+        # A single directory scan replaces a stat per annotation and image format.
+        image_files = defaultdict(list)
+        with os.scandir(image_dir) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext in IMAGE_FORMATS or ext == f".{image_format}":
+                    image_files[stem].append(entry.name)
 
-            with Image.open(image_path) as image:
-                w, h = image.size
-                images.append(image)
+        annotation_files = [f for f in os.listdir(annotations_dir) if f.endswith(".txt")]
+        load_annotation = partial(YOLO._load_annotation, image_dir, annotations_dir, image_format, image_files)
+        return dataset_utils.map_concurrently(load_annotation, annotation_files, 4)
 
-            bboxes_per = []
-            classes_per = []
+    @staticmethod
+    def _load_annotation(image_dir: str, annotations_dir: str, image_format: str, image_files: Dict[str, List[str]],
+                         file: str) -> Tuple[str, Image.Image, np.ndarray, np.ndarray]:
+        """
+        Loads the image and the bounding boxes and classes of a single YOLO txt file.
+        :param image_dir: THe directory of where the images are stored.
+        :param annotations_dir: The directory of the annotations file.
+        :param image_format: The format of the images being used, used to choose between images sharing a name.
+        :param image_files: The image filenames in :param image_dir keyed by their name without the extension.
+        :param file: The name of the txt file.
+        :return: Returns the name, image, bounding boxes and classes for the image.
+        :raise OSError: If there are no image files corresponding to :param file.
+        :raise OSError: If there more than one image file corresponding to :param file.
+        """
+        file_path = f"{annotations_dir}/{file}"
+        candidates = image_files.get(os.path.splitext(file)[0], [])
+        if len(candidates) == 0:
+            raise OSError(f"There is no image file in {image_dir} corresponding to {file}.")
+        if len(candidates) > 1:
+            candidates = [c for c in candidates if c.endswith(f".{image_format}")]
+            if len(candidates) != 1:
+                raise OSError(f"There are too many image files in {image_dir} corresponding to {file}.")
+        name = candidates[0]
+
+        with Image.open(f"{image_dir}/{name}") as image:
+            w, h = image.size
 
-            with open(file_path, "r") as f:
-                for line in f.readlines():
-                    cls, *bbox = line.split()
-                    x0, y0, dx, dy = [float(p) for p in bbox]
-                    bboxes_per.append(np.asarray([y0 * h, x0 * w, (y0 + dy) * h, (x0 + dx) * w], dtype="int64"))
-                    classes_per.append(cls)
-                bboxes.append(np.asarray(bboxes_per))
-                classes.append(np.asarray(classes_per))
-        return names, images, bboxes, classes
+        # Background images have empty label files, which np.loadtxt would warn about.
+        with open(file_path, "r") as f:
+            lines = [line for line in f if line.strip()]
+        if lines:
+            annotation = np.loadtxt(lines, dtype=str, ndmin=2).reshape(-1, 5)
+        else:
+            annotation = np.empty((0, 5), dtype=str)
+        x0, y0, dx, dy = annotation[:, 1:].astype(np.float64).T
+        bboxes_per = np.stack([y0 * h, x0 * w, (y0 + dy) * h, (x0 + dx) * w], axis=1)
+        # Rounding rather than truncating recovers the pixel coordinates written by download.
+        return name, image, np.rint(bboxes_per).astype("int64"), annotation[:, 0]
 
     @staticmethod
     def download(download_dir: str, image_names: List[str], images: List, bboxes: List[np.ndarray],
-                 classes: List[np.ndarray]) -> None:
+                 classes: List[np.ndarray], class_map: Optional[Dict[str, int]] = None) -> None:
         """
         Downloads a YOLO txt files to the :param download_dir with the filename annotations.
         :param download_dir: The directory where the annotations are being downloaded.
@@ -597,6 +621,8 @@ class YOLO(LocalisationAnnotation):
             n being the number of bounding boxes for the image and the bounding boxes in the format [y0, x0, y1, x1].
         :param classes: The classes information for the images. A list of np.ndarray with the shape (n, ),
             n being the number of bounding boxes for the image.
+        :param class_map: A map of classes to there encoded values by default it will create a map like:
+            class_map = {cls: idx for idx, cls in enumerate(sorted(unique_classes))}
         :raise AssertionError: The length of the params :param image_names, :param images :param bboxes and :param classes
             must be the same.
         """
@@ -607,13 +633,19 @@ class YOLO(LocalisationAnnotation):
             f"len(bboxes): {len(bboxes)}\n" \
             f"len(classes): {len(classes)}"
 
-        classes_dict = {n: i for i, n in enumerate({cls for classes_per in classes for cls in classes_per})}
+        if class_map is None:
+            non_empty = [np.asarray(classes_per) for classes_per in classes if len(classes_per) != 0]
+            unique_classes = np.unique(np.concatenate(non_empty)).tolist() if non_empty else []
+            class_map = {cls: idx for idx, cls in enumerate(unique_classes)}
+
         for name, image, bboxes_per, classes_per in zip(image_names, images, bboxes, classes):
-            save_name = reduce(lambda n, fmt: n.strip(fmt), IMAGE_FORMATS, name)
-            with open(f"{download_dir}/{save_name}.txt", "w") as f:
-                w, h = image.size
-                for (y0, x0, y1, x1), cls in zip(bboxes_per, classes_per):
-                    f.write(f"{classes_dict[cls]} {x0 / w} {y0 / h} {(x1 - x0) / w} {(y1 - y0) / h}\n")
+            save_name, _ = os.path.splitext(name)
+            w, h = image.size
+            y0, x0, y1, x1 = np.asarray(bboxes_per, dtype=np.float64).reshape(-1, 4).T
+            mapped_classes = np.fromiter((class_map[cls] for cls in classes_per), dtype=np.int64,
+                                         count=len(classes_per))
+            annotation = np.column_stack([mapped_classes, x0 / w, y0 / h, (x1 - x0) / w, (y1 - y0) / h])
+            np.savetxt(f"{download_dir}/{save_name}.txt", annotation, fmt="%d %.6f %.6f %.6f %.6f")
 
 
 @strategy_method(LocalisationAnnotationFormats)
@@ -647,7 +679,7 @@ class OIDv4(LocalisationAnnotation):
         for file in annotation_files:
             file_path = f"{annotations_dir}/{file}"
             image_path = f"{image_dir}/{file.strip('.txt')}.{image_format}"
-            name = re.split("/|\\\\", image_path)[-1]
+            name = os.path.basename(image_path)
             names.append(name)
 
             with Image.open(image_path) as image:
@@ -689,7 +721,7 @@ class OIDv4(LocalisationAnnotation):
             f"len(classes): {len(classes)}"
 
         for name, image, bboxes_per, classes_per in zip(image_names, images, bboxes, classes):
-            save_name = reduce(lambda n, fmt: n.strip(fmt), IMAGE_FORMATS, name)
+            save_name, _ = os.path.splitext(name)
             with open(f"{download_dir}/{save_name}.txt", "w") as f:
                 f.writelines(f"{cls} {x0} {y0} {x1} {y1}\n" for (y0, x0, y1, x1), cls in zip(bboxes_per, classes_per))
 
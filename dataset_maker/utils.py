@@ -1,7 +1,7 @@
 import numpy as np
-import skimage
+import cv2
 # import pycocotools
-from typing import Iterable, Tuple
+from typing import Iterable, Sequence, Tuple
 from itertools import islice
 
 
@@ -32,15 +32,38 @@ def bbox(x: Iterable[int], y: Iterable[int], out_format: str = "2p") -> Tuple[in
         NotImplementedError()
 
 
+def bboxes(xs: Sequence[Iterable[int]], ys: Sequence[Iterable[int]]) -> np.ndarray:
+    """
+    Gets the bounding boxes of several polygons at once.
+    :param xs: The x points of each polygon.
+    :param ys: The y points of each polygon.
+    :return: np.ndarray with the shape (n, 4) containing the bounding boxes in the format [y0, x0, y1, x1].
+    :raise AssertionError: If the lengths of xs and ys differ or a polygon has no points.
+    """
+    assert len(xs) == len(ys), f"Length of both xs and and ys must be the same ({len(xs)} != {len(ys)})."
+    assert all(len(x) > 0 for x in xs), "Every polygon must have at least one point."
+    if len(xs) == 0:
+        return np.empty((0, 4), dtype=np.int64)
+    offsets = np.cumsum([0] + [len(x) for x in xs[:-1]])
+    all_xs = np.concatenate([np.asarray(x) for x in xs])
+    all_ys = np.concatenate([np.asarray(y) for y in ys])
+    return np.stack([
+        np.minimum.reduceat(all_ys, offsets),
+        np.minimum.reduceat(all_xs, offsets),
+        np.maximum.reduceat(all_ys, offsets),
+        np.maximum.reduceat(all_xs, offsets)
+    ], axis=1)
+
+
 def bbox_area(y0, x0, y1, x1):
     return (y1 - y0) * (x1 - x0)
 
 
 def polygon_to_mask(x, y, width, height):
     assert len(x) == len(y), f"Length of both x and and y must be the same ({len(x)} != {len(y)})."
-    m = np.zeros((width, height), dtype=np.uint8)
-    rr, cc = skimage.draw.polygon(y, x)
-    m[rr, cc] = 1
+    m = np.zeros((height, width), dtype=np.uint8)
+    points = np.round(np.stack([x, y], axis=1)).astype(np.int32)
+    cv2.fillPoly(m, [points], 1)
     return m
 
 
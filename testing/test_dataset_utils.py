@@ -0,0 +1,79 @@
+import unittest
+import tempfile
+import time
+from dataset_maker.annotations import dataset_utils
+import numpy as np
+
+
+class TestJson(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = f"{self.temp_dir.name}/data.json"
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def test_round_trip(self):
+        data = {"a.png": {"regions": [{"x": [1, 2], "y": [3, 4]}]}, "b.png": {"regions": []}}
+        dataset_utils.dump_json(data, self.path)
+        self.assertEqual(dataset_utils.load_json(self.path), data)
+
+    def test_numpy_str_keys(self):
+        names = np.array(["a.png", "b.png"])
+        dataset_utils.dump_json({name: i for i, name in enumerate(names)}, self.path)
+        self.assertEqual(dataset_utils.load_json(self.path), {"a.png": 0, "b.png": 1})
+
+
+def slow_square(x):
+    # Later items finish first so that out of order completion would be noticed.
+    time.sleep(0.002 * (10 - x % 10))
+    return x * x
+
+
+def fail_on_three(x):
+    if x == 3:
+        raise ValueError("three")
+    return x
+
+
+class TestMapConcurrently(unittest.TestCase):
+    def test_order(self):
+        squares, roots = dataset_utils.map_concurrently(lambda x: (slow_square(x), x), range(20), 2)
+        self.assertEqual(squares, [x * x for x in range(20)])
+        self.assertEqual(roots, list(range(20)))
+
+    def test_empty(self):
+        self.assertEqual(dataset_utils.map_concurrently(lambda x: (x, x, x), [], 3), ([], [], []))
+
+    def test_worker_exception(self):
+        with self.assertRaises(ValueError):
+            dataset_utils.map_concurrently(lambda x: (fail_on_three(x), ), range(10), 1)
+
+
+class TestStreamConcurrently(unittest.TestCase):
+    def test_order(self):
+        results = list(dataset_utils.stream_concurrently(slow_square, range(50), max_pending=4))
+        self.assertEqual(results, [x * x for x in range(50)])
+
+    def test_empty(self):
+        self.assertEqual(list(dataset_utils.stream_concurrently(slow_square, [])), [])
+
+    def test_max_pending(self):
+        max_pending = 3
+        pulled = []
+
+        def items():
+            for i in range(20):
+                pulled.append(i)
+                yield i
+
+        for consumed, result in enumerate(dataset_utils.stream_concurrently(slow_square, items(), max_pending)):
+            self.assertEqual(result, consumed * consumed)
+            self.assertLessEqual(len(pulled), consumed + max_pending)
+        self.assertEqual(len(pulled), 20)
+
+    def test_worker_exception(self):
+        results = dataset_utils.stream_concurrently(fail_on_three, range(10), max_pending=2)
+        self.assertEqual([next(results) for _ in range(3)], [0, 1, 2])
+        with self.assertRaises(ValueError):
+            next(results)
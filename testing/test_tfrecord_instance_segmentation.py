@@ -0,0 +1,43 @@
+import unittest
+import tempfile
+import io
+import os
+from dataset_maker.annotations import instance_segmentation as anno
+import tensorflow as tf
+from PIL import Image
+import numpy as np
+
+
+class TestCOCOTFRecord(unittest.TestCase):
+    def setUp(self):
+        self.width, self.height = 60, 40
+        self.names = ["img_0.png", "img_1.png"]
+        self.images = [Image.fromarray(np.zeros((self.height, self.width, 3), dtype=np.uint8)) for _ in self.names]
+        self.polygons = [
+            [([2, 11, 11, 2], [3, 3, 7, 7])],
+            [([0, 59, 59, 0], [0, 0, 9, 9]), ([40, 49, 49, 40], [20, 20, 39, 39])]
+        ]
+        self.bboxes = [np.array([[3, 2, 7, 11]]), np.array([[0, 0, 9, 59], [20, 40, 39, 49]])]
+        self.classes = [np.array(["square"]), np.array(["bar", "square"])]
+
+        with tempfile.TemporaryDirectory() as td:
+            for name, image in zip(self.names, self.images):
+                image.save(f"{td}/{name}")
+            anno.COCO.download(td, self.names, self.images, self.bboxes, self.polygons, self.classes)
+            anno.COCO().create_tfrecord(td, td, f"{td}/tfrecord", 1)
+            tfrecord_files = [f"{td}/{f}" for f in os.listdir(td) if "tfrecord" in f]
+            self.tf_examples = [tf.train.Example.FromString(e)
+                                for e in tf.compat.v1.io.tf_record_iterator(tfrecord_files[0])]
+
+    def test_masks(self):
+        self.assertEqual(len(self.tf_examples), len(self.names))
+        for example, poly_per in zip(self.tf_examples, self.polygons):
+            feature = example.features.feature
+            self.assertEqual(feature["image/height"].int64_list.value, [self.height])
+            self.assertEqual(feature["image/width"].int64_list.value, [self.width])
+            masks = feature["image/object/mask"].bytes_list.value
+            self.assertEqual(len(masks), len(poly_per))
+            for encoded, (xs, ys) in zip(masks, poly_per):
+                mask = np.array(Image.open(io.BytesIO(encoded)))
+                self.assertEqual(mask.shape, (self.height, self.width))
+                self.assertEqual(np.count_nonzero(mask), (max(xs) - min(xs) + 1) * (max(ys) - min(ys) + 1))
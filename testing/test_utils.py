@@ -0,0 +1,43 @@
+import unittest
+from dataset_maker import utils
+import numpy as np
+
+
+class TestBboxes(unittest.TestCase):
+    def test_matches_bbox(self):
+        rng = np.random.default_rng(0)
+        xs, ys = [], []
+        for n in (1, 2, 3, 7, 50):
+            xs.append(rng.integers(0, 1000, n).tolist())
+            ys.append(rng.integers(0, 1000, n).tolist())
+        expected = np.array([utils.bbox(x, y) for x, y in zip(xs, ys)])
+        result = utils.bboxes(xs, ys)
+        self.assertEqual(result.dtype, np.int64)
+        np.testing.assert_array_equal(result, expected)
+
+    def test_single_polygon(self):
+        np.testing.assert_array_equal(utils.bboxes([[4, 2, 9]], [[3, 8, 1]]), [utils.bbox([4, 2, 9], [3, 8, 1])])
+
+    def test_no_polygons(self):
+        result = utils.bboxes([], [])
+        self.assertEqual(result.shape, (0, 4))
+
+    def test_empty_polygon(self):
+        with self.assertRaises(AssertionError):
+            utils.bboxes([[1, 2], [], [3, 4]], [[5, 6], [], [7, 8]])
+
+
+class TestPolygonToMask(unittest.TestCase):
+    def test_non_square_shape(self):
+        mask = utils.polygon_to_mask([2, 11, 11, 2], [3, 3, 7, 7], width=20, height=10)
+        self.assertEqual(mask.shape, (10, 20))
+        self.assertEqual(mask.dtype, np.uint8)
+
+    def test_filled_pixels(self):
+        mask = utils.polygon_to_mask([2, 11, 11, 2], [3, 3, 7, 7], width=20, height=10)
+        self.assertEqual(mask.sum(), 10 * 5)
+        self.assertTrue(mask[3:8, 2:12].all())
+
+    def test_float_points(self):
+        mask = utils.polygon_to_mask([1.6, 5.4, 5.4, 1.6], [0.2, 0.2, 3.7, 3.7], width=8, height=6)
+        np.testing.assert_array_equal(np.argwhere(mask)[[0, -1]], [[0, 2], [4, 5]])
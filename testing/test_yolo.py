@@ -0,0 +1,86 @@
+import unittest
+import tempfile
+import warnings
+from dataset_maker.annotations import localisation as anno
+import numpy as np
+from PIL import Image
+
+
+class TestYOLOLoad(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.td = self.temp_dir.name
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def save_image(self, name, width=40, height=30):
+        image = Image.fromarray(np.zeros((height, width, 3), dtype=np.uint8))
+        image.save(f"{self.td}/{name}")
+        return image
+
+    def test_empty_label_file(self):
+        self.save_image("background.png")
+        open(f"{self.td}/background.txt", "w").close()
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            names, _, bboxes, classes = anno.YOLO.load(self.td, self.td)
+        self.assertEqual(names, ["background.png"])
+        self.assertEqual(bboxes[0].shape, (0, 4))
+        self.assertEqual(classes[0].shape, (0, ))
+
+    def test_download_load_round_trip_is_exact(self):
+        names, images, bboxes, classes = [], [], [], []
+        for width, height in ((50, 50), (97, 61), (640, 480), (1333, 777), (1999, 1024)):
+            name = f"img_{width}x{height}.png"
+            image = self.save_image(name, width, height)
+            xs = np.arange(width - 1)
+            ys = xs % (height - 1)
+            names.append(name)
+            images.append(image)
+            bboxes.append(np.stack([ys, xs, ys + 1, xs + 1], axis=1))
+            classes.append(np.full(len(xs), "square"))
+        anno.YOLO.download(self.td, names, images, bboxes, classes)
+
+        dl_names, _, dl_bboxes, _ = anno.YOLO.load(self.td, self.td)
+        dl_bboxes_dict = dict(zip(dl_names, dl_bboxes))
+        for name, bboxes_per in zip(names, bboxes):
+            np.testing.assert_array_equal(dl_bboxes_dict[name], bboxes_per)
+
+    def test_load_image_format_outside_image_formats(self):
+        self.save_image("img.bmp")
+        with open(f"{self.td}/img.txt", "w") as f:
+            f.write("0 0.25 0.5 0.5 0.25\n")
+        names, _, bboxes, _ = anno.YOLO.load(self.td, self.td, image_format="bmp")
+        self.assertEqual(names, ["img.bmp"])
+        np.testing.assert_array_equal(bboxes[0], [[15, 10, 22, 30]])
+
+
+class TestYOLODownload(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.td = self.temp_dir.name
+        self.image = Image.fromarray(np.zeros((30, 40, 3), dtype=np.uint8))
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def class_column(self, name):
+        with open(f"{self.td}/{name}.txt") as f:
+            return [int(line.split()[0]) for line in f if line.strip()]
+
+    def test_explicit_class_map(self):
+        bboxes = [np.array([[0, 0, 10, 10], [5, 5, 20, 20]]), np.array([[1, 2, 3, 4]])]
+        classes = [np.array(["dog", "cat"]), np.array(["bird"])]
+        class_map = {"cat": 7, "dog": 3, "bird": 0}
+        anno.YOLO.download(self.td, ["a.png", "b.png"], [self.image] * 2, bboxes, classes, class_map=class_map)
+        self.assertEqual(self.class_column("a"), [3, 7])
+        self.assertEqual(self.class_column("b"), [0])
+
+    def test_default_class_map_is_sorted(self):
+        bboxes = [np.array([[0, 0, 10, 10], [5, 5, 20, 20]]), np.empty((0, 4)), np.array([[1, 2, 3, 4]])]
+        classes = [np.array(["dog", "cat"]), np.array([]), np.array(["bird"])]
+        anno.YOLO.download(self.td, ["a.png", "empty.png", "b.png"], [self.image] * 3, bboxes, classes)
+        self.assertEqual(self.class_column("a"), [2, 1])
+        self.assertEqual(self.class_column("empty"), [])
+        self.assertEqual(self.class_column("b"), [0])